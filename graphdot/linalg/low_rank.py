@@ -1,11 +1,17 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 '''Low-rank approximation of square matrices.'''
+from functools import singledispatch
 import numpy as np
+import scipy.sparse as sparse
 import scipy.sparse.linalg as splin
+from scipy.linalg.lapack import get_lapack_funcs
 
 
 class LowRankBase:
+    # let NumPy defer binary operators to the low-rank classes
+    __array_ufunc__ = None
+
     def __add__(self, other):
         return add(self, other)
 
@@ -15,6 +21,18 @@ class LowRankBase:
     def __matmul__(self, other):
         return matmul(self, other)
 
+    def __rmatmul__(self, other):
+        return matmul(other, self)
+
+
+def _accumulate(terms):
+    '''Sums freshly computed terms into the first one in place.'''
+    terms = iter(terms)
+    total = next(terms)
+    for t in terms:
+        total += t
+    return total
+
 
 class Sum(LowRankBase):
     '''Represents summations of factor approximations. Due to the bilinear
@@ -35,17 +53,17 @@ class Sum(LowRankBase):
         return Sum([-f for f in self.factors])
 
     def diagonal(self):
-        return np.sum([f.diagonal() for f in self.factors], axis=0)
+        return _accumulate(f.diagonal() for f in self.factors)
 
     def trace(self):
-        return np.sum([f.diagonal().sum() for f in self.factors])
+        return sum(f.trace() for f in self.factors)
 
     def quadratic(self, a, b):
         '''Computes a @ X @ b.'''
-        return np.sum([f.quadratic(a, b) for f in self.factors], axis=0)
+        return _accumulate(f.quadratic(a, b) for f in self.factors)
 
-    def todense(self):
-        return np.sum([f.todense() for f in self.factors], axis=0)
+    def todense(self, out=None):
+        return _stack(self).todense(out=out)
 
 
 class LATR(LowRankBase):
@@ -72,16 +90,16 @@ class LATR(LowRankBase):
         return LATR(self.rhs.T, self.lhs.T)
 
     def __neg__(self):
-        return LATR(-self.lhs, self.rhs)
+        return LATR(self.lhs, -self.rhs)
 
-    def todense(self):
-        return self.lhs @ self.rhs
+    def todense(self, out=None):
+        return np.matmul(self.lhs, self.rhs, out=out)
 
     def diagonal(self):
-        return np.sum(self.lhs * self.rhs.T, axis=1)
+        return np.einsum('ij,ji->i', self.lhs, self.rhs)
 
     def trace(self):
-        return self.diagonal().sum()
+        return np.einsum('ij,ji->', self.lhs, self.rhs)
 
     def quadratic(self, a, b):
         '''Computes a @ X @ b.'''
@@ -89,17 +107,80 @@ class LATR(LowRankBase):
 
     def quadratic_diag(self, a, b):
         '''Computes diag(a @ X @ b).'''
-        return LATR(a @ self.lhs, self.rhs @ b).diagonal()
+        return np.einsum('ij,ji->i', a @ self.lhs, self.rhs @ b)
+
+
+def _gesdd(X, overwrite_x=False):
+    '''Computes the thin SVD of a dense matrix by calling the LAPACK
+    divide-and-conquer driver directly. If X is a Fortran-ordered temporary,
+    ``overwrite_x`` lets LAPACK work on it in place without a copy.'''
+    gesdd, = get_lapack_funcs(('gesdd',), (X,))
+    U, S, _, info = gesdd(
+        X, compute_uv=1, full_matrices=0, overwrite_a=overwrite_x
+    )
+    if info > 0:
+        raise np.linalg.LinAlgError('SVD did not converge.')
+    elif info < 0:
+        raise ValueError(f'Illegal value in argument {-info} of gesdd.')
+    return U, S
+
+
+def _svd(X, rank=None, oversample=10, random_state=None):
+    '''Computes the left singular vectors and singular values of X. If
+    ``rank`` is given, only the leading ``rank`` singular triplets are
+    resolved using the randomized range finder of Halko, Martinsson, and
+    Tropp, SIAM Review 53(2), 2011, with random numbers drawn from
+    ``np.random.default_rng(random_state)``.'''
+    if rank is None or rank + oversample >= min(X.shape):
+        if sparse.issparse(X):
+            U, S = _gesdd(X.toarray(order='F'), overwrite_x=True)
+        else:
+            U, S = _gesdd(X)
+        return (U, S) if rank is None else (U[:, :rank], S[:rank])
+    rng = np.random.default_rng(random_state)
+    if sparse.issparse(X):
+        U, S, _ = splin.svds(
+            X, k=rank, v0=rng.standard_normal(min(X.shape)),
+            return_singular_vectors='u'
+        )
+        order = np.argsort(S)[::-1]
+        return U[:, order], S[order]
+    Omega = rng.standard_normal((X.shape[1], rank + oversample))
+    Q, _ = np.linalg.qr(X @ Omega)
+    Ub, S = _gesdd((X.T @ Q).T, overwrite_x=True)
+    return (Q @ Ub)[:, :rank], S[:rank]
 
 
 class LLT(LATR):
     r'''A special case of factor approximation where the matrix is symmetric
     and positive-semidefinite. In this case, the matrix can be represented as
-    :py:math:`L \cdot L^\mathsf{T}` from a spectral decomposition.'''
+    :py:math:`L \cdot L^\mathsf{T}` from a spectral decomposition.
 
-    def __init__(self, X, rcond=0, mode='truncate'):
-        if isinstance(X, np.ndarray):
-            U, S, _ = np.linalg.svd(X, full_matrices=False)
+    Parameters
+    ----------
+    X: ndarray or sparse matrix or tuple
+        The factor :py:math:`X` of the matrix :py:math:`X \cdot X^\mathsf{T}`,
+        or a tuple of precomputed singular vectors and singular values.
+    rcond: float
+        Threshold for small singular values.
+    mode: 'truncate' or 'clamp'
+        Determines how small singular values of X are handled.
+    rank: int or None
+        If not None, only the leading ``rank`` singular values of X are
+        computed using a randomized truncated SVD.
+    oversample: int
+        Number of extra random samples used by the randomized truncated SVD.
+    random_state: None or int or numpy.random.Generator
+        Seed or generator for the randomized truncated SVD, as accepted by
+        :py:func:`numpy.random.default_rng`.
+    '''
+
+    def __init__(self, X, rcond=0, mode='truncate', rank=None, oversample=10,
+                 random_state=None):
+        if isinstance(X, np.ndarray) or sparse.issparse(X):
+            U, S = _svd(
+                X, rank=rank, oversample=oversample, random_state=random_state
+            )
             beta = S.max() * rcond
             if mode == 'truncate':
                 mask = S >= beta
@@ -114,18 +195,28 @@ class LLT(LATR):
                 )
         elif isinstance(X, tuple) and len(X) == 2:
             self.U, self.S = X
-        self._lhs = self.U * self.S
+        self._lhs = None
 
     @property
     def lhs(self):
+        # U * S is formed on demand as many operations, e.g. logdet and
+        # powers, only need the spectral factors.
+        if self._lhs is None:
+            self._lhs = self.U * self.S
         return self._lhs
 
     @property
     def rhs(self):
-        return self._lhs.T
+        return self.lhs.T
+
+    # U has orthonormal columns, hence the diagonal and trace follow from U
+    # and S without forming U * S.
 
     def diagonal(self):
-        return np.sum(self.lhs**2, axis=1)
+        return (self.U**2) @ (self.S**2)
+
+    def trace(self):
+        return np.dot(self.S, self.S)
 
     def pinv(self):
         return LLT((self.U, 1 / self.S))
@@ -137,10 +228,13 @@ class LLT(LATR):
         return (self.S.max() / self.S.min())**2
 
     def __pow__(self, exp):
+        if exp == 1:
+            return self
         return LLT((self.U, self.S**exp))
 
 
-def dot(X, Y=None, method='auto', rcond=0, mode='truncate'):
+def dot(X, Y=None, method='auto', rcond=0, mode='truncate', rank=None,
+        oversample=10, random_state=None):
     r'''A utility method that creates low-rank matrices
     :py:math:`A \doteq X \cdot Y`.
 
@@ -162,11 +256,21 @@ def dot(X, Y=None, method='auto', rcond=0, mode='truncate'):
         Determines how small singular values of the original matrix are
         handled. For 'truncate', small values are discarded; for 'clamp', they
         are fixed to be the product of the largest singular value and rcond.
+    rank: int or None
+        If not None, only the leading singular values of X are computed using
+        a randomized truncated SVD when method is 'spectral'.
+    oversample: int
+        Number of extra random samples used by the randomized truncated SVD.
+    random_state: None or int or numpy.random.Generator
+        Seed or generator for the randomized truncated SVD.
     '''
     assert method in ['auto', 'direct', 'spectral'], f'Unknown method {method}'
     if Y is None:
         if method == 'spectral' or method == 'auto':
-            return LLT(X, rcond=rcond, mode=mode)
+            return LLT(
+                X, rcond=rcond, mode=mode, rank=rank, oversample=oversample,
+                random_state=random_state
+            )
         else:
             return LATR(X, X.T)
     else:
@@ -178,37 +282,159 @@ def dot(X, Y=None, method='auto', rcond=0, mode='truncate'):
             return LATR(X, Y)
 
 
+def _canonicalize(factors):
+    '''Flattens nested summations, merges factors that share the same left
+    hand side, and drops factors of zero rank.'''
+    flat = []
+    for f in factors:
+        if isinstance(f, Sum):
+            flat += _canonicalize(f.factors)
+        else:
+            flat.append(f)
+    merged = {}
+    for f in flat:
+        if isinstance(f, LLT) and f._lhs is None:
+            # keep LLTs lazy: those sharing U are merged spectrally.
+            if len(f.S) == 0:
+                continue
+            key = ('U', id(f.U))
+            g = merged.get(key)
+            merged[key] = f if g is None else LLT(
+                (f.U, np.sqrt(g.S**2 + f.S**2))
+            )
+        else:
+            if f.lhs.shape[1] == 0:
+                continue
+            key = id(f.lhs)
+            g = merged.get(key)
+            merged[key] = f if g is None else LATR(g.lhs, g.rhs + f.rhs)
+    return list(merged.values()) or flat[:1]
+
+
+def _stack(A):
+    '''Re-compresses a summation of factors into a single factor
+    approximation.'''
+    return LATR(
+        np.hstack([f.lhs for f in A.factors]),
+        np.vstack([f.rhs for f in A.factors])
+    )
+
+
 def add(A, B):
-    factors = A.factors if isinstance(A, Sum) else [A]
-    factors += B.factors if isinstance(B, Sum) else [B]
-    return Sum(factors)
+    return Sum(_canonicalize([A, B]))
 
 
 def sub(A, B):
-    factors = A.factors if isinstance(A, Sum) else [A]
-    factors += [-f for f in B.factors] if isinstance(B, Sum) else [-B]
-    return Sum(factors)
+    return Sum(_canonicalize([A, -B]))
 
 
 def matmul(A, B):
-    if isinstance(A, Sum):
-        if isinstance(B, Sum):
-            return Sum([
-                a @ b for a in A.factors for b in B.factors
-            ])
-        else:
-            return Sum([
-                a @ B for a in A.factors
-            ])
+    '''Multiplies two matrices of which at least one is low-rank. The
+    implementation is selected by the type of A and then of B, so that new
+    low-rank types can be supported by registering additional overloads with
+    ``matmul.register``. Products among the built-in types are looked up
+    directly, as resolving two levels of singledispatch costs about as much
+    as a small product itself.'''
+    impl = _builtin_matmul.get((type(A), type(B)))
+    if impl is not None:
+        return impl(B, A)
+    return _matmul(A, B)
+
+
+@singledispatch
+def _matmul(A, B):
+    return _dense_matmul(B, A)
+
+
+@_matmul.register(Sum)
+def _(A, B):
+    return _sum_matmul(B, A)
+
+
+@_matmul.register(LATR)
+def _(A, B):
+    return _latr_matmul(B, A)
+
+
+matmul.register = _matmul.register
+
+
+# Summations are re-compressed into single factors only when the product
+# remains low-rank, i.e. with another Sum or a dense matrix, where it turns
+# a loop of products into one. Otherwise stacking would only add a copy of
+# all factors, so the products are taken factor by factor.
+
+@singledispatch
+def _sum_matmul(B, A):
+    '''Computes A @ B for a Sum A and a dense B.'''
+    if np.ndim(B) == 2:
+        return _stack(A) @ B
     else:
-        if isinstance(B, Sum):
-            return Sum([
-                A @ b for b in B.factors
-            ])
-        elif isinstance(B, LATR):
-            return LATR(A.lhs, (A.rhs @ B.lhs) @ B.rhs)
-        else:
-            return A.lhs @ (A.rhs @ B)
+        return sum(a @ B for a in A.factors)
+
+
+@_sum_matmul.register(Sum)
+def _(B, A):
+    return _stack(A) @ _stack(B)
+
+
+@_sum_matmul.register(LATR)
+def _(B, A):
+    return Sum([a @ B for a in A.factors])
+
+
+@singledispatch
+def _latr_matmul(B, A):
+    '''Computes A @ B for a LATR A and a dense B.'''
+    if np.ndim(B) == 2:
+        return LATR(A.lhs, A.rhs @ B)
+    else:
+        return A.lhs @ (A.rhs @ B)
+
+
+@_latr_matmul.register(Sum)
+def _(B, A):
+    return Sum([A @ b for b in B.factors])
+
+
+@_latr_matmul.register(LATR)
+def _(B, A):
+    return LATR(A.lhs, (A.rhs @ B.lhs) @ B.rhs)
+
+
+@singledispatch
+def _dense_matmul(B, A):
+    '''Computes A @ B for a dense A.'''
+    return A @ B
+
+
+@_dense_matmul.register(Sum)
+def _(B, A):
+    if np.ndim(A) == 2:
+        return A @ _stack(B)
+    else:
+        return sum(A @ b for b in B.factors)
+
+
+@_dense_matmul.register(LATR)
+def _(B, A):
+    if np.ndim(A) == 2:
+        return LATR(A @ B.lhs, B.rhs)
+    else:
+        return (A @ B.lhs) @ B.rhs
+
+
+_builtin_matmul = {
+    (a, b): table.dispatch(b)
+    for a, table in [
+        (Sum, _sum_matmul),
+        (LATR, _latr_matmul),
+        (LLT, _latr_matmul),
+        (np.ndarray, _dense_matmul),
+    ]
+    for b in [Sum, LATR, LLT, np.ndarray]
+    if (a, b) != (np.ndarray, np.ndarray)
+}
 
 
 def pinvh(A: LATR, d, k='auto', rcond=1e-10, mode='truncate'):
@@ -258,7 +484,7 @@ def pinvh(A: LATR, d, k='auto', rcond=1e-10, mode='truncate'):
             return self.A @ b + self.d * b
 
         def _matmat(self, b):
-            return self.A @ b + self.d[:, None] * b
+            return (self.A @ b).todense() + self.d[:, None] * b
 
         def _adjoint(self):
             return self
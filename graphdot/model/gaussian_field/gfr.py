@@ -3,11 +3,32 @@
 import time
 import warnings
 import numpy as np
+import scipy.sparse as sparse
+import scipy.sparse.linalg as splin
 from scipy.optimize import minimize
 from graphdot.linalg.cholesky import CholSolver
 from graphdot.util.printer import markdown as mprint
 
 
+class _SparseLaplacianSolver:
+    '''Solves linear systems of the graph Laplacian diag(D) - (W + s) with
+    a sparse W by a sparse LU factorization of diag(D) - W and a
+    Sherman-Morrison correction for the constant smoothing term.'''
+
+    def __init__(self, D, W, s):
+        self.lu = splin.splu(sparse.csc_matrix(sparse.diags(D) - W))
+        self.s = s
+        if s:
+            self.u = self.lu.solve(np.ones(len(D)))
+            self.c = s / (1 - s * self.u.sum())
+
+    def __matmul__(self, b):
+        x = self.lu.solve(b)
+        if self.s:
+            x += self.c * np.multiply.outer(self.u, x.sum(axis=0))
+        return x
+
+
 class GaussianFieldRegressor:
     '''Semi-supervised learning and prediction of missing labels of continuous
     value on a graph. Reference: Zhu, Ghahramani, Lafferty. ICML 2003
@@ -36,6 +57,7 @@ class GaussianFieldRegressor:
         if optimizer is True:
             self.optimizer = 'L-BFGS-B'
         self.smoothing = smoothing
+        self._factor_cache = []
 
     def fit(self, X, y, loss='loocv2', tol=1e-5, repeat=1, theta_jitter=1.0,
             verbose=False):
@@ -73,7 +95,7 @@ class GaussianFieldRegressor:
         '''
         assert len(X) == len(y)
         X = np.asarray(X)
-        y = np.asarray(y, dtype=np.float)
+        y = np.asarray(y, dtype=float)
 
         if hasattr(self.weight, 'theta') and self.optimizer:
             try:
@@ -91,10 +113,13 @@ class GaussianFieldRegressor:
                 yield x0
                 yield from x0 + theta_jitter * np.random.randn(n - 1, len(x0))
 
+            labeled = np.isfinite(y)
+            y_labeled = y[labeled]
             opt = self._hyper_opt(
                 method=self.optimizer,
                 fun=lambda theta, objective=objective: objective(
-                    X, y, theta=theta, eval_gradient=True, verbose=verbose
+                    X, y, theta=theta, eval_gradient=True, verbose=verbose,
+                    labeled=labeled, y_labeled=y_labeled
                 ),
                 xgen=xgen(repeat), tol=tol, verbose=verbose
             )
@@ -135,16 +160,19 @@ class GaussianFieldRegressor:
         '''
         assert len(X) == len(y)
         X = np.asarray(X)
-        y = np.asarray(y, dtype=np.float)
+        y = np.asarray(y, dtype=float)
 
+        labeled = np.isfinite(y)
         z = y.copy()
         if return_influence is True:
-            z[~np.isfinite(y)], influence = self._predict(
-                X, y, return_influence=True
+            z[~labeled], influence = self._predict(
+                X, y[labeled], labeled, return_influence=True
             )
             return z, influence
         else:
-            z[~np.isfinite(y)] = self._predict(X, y, return_influence=False)
+            z[~labeled] = self._predict(
+                X, y[labeled], labeled, return_influence=False
+            )
             return z
 
     def fit_predict(self, X, y, loss='average-label-entropy', tol=1e-5,
@@ -217,79 +245,141 @@ class GaussianFieldRegressor:
 
         return opt
 
-    def _predict(self, X, y, return_influence=False):
-        labeled = np.isfinite(y)
-        f_l = y[labeled]
-        if len(f_l) == len(y):
-            raise RuntimeError(
-                'All samples are labeled, no predictions will be made.'
-            )
-        if self.weight == 'precomputed':
-            W_uu = X[~labeled, :][:, ~labeled] + self.smoothing
-            W_ul = X[~labeled, :][:, labeled] + self.smoothing
+    @staticmethod
+    def _rowsum(W):
+        return W, np.asarray(W.sum(axis=1)).ravel()
+
+    def _assemble(self, X, Y=None):
+        '''Evaluates the weight matrix and its row sums. Weight objects that
+        implement ``assemble(X, Y, return_rowsum=True)``, such as subclasses of
+        :py:class:`Weight`, may compute both in a single pass.'''
+        if hasattr(self.weight, 'assemble'):
+            return self.weight.assemble(X, Y, return_rowsum=True)
+        elif Y is None:
+            return self._rowsum(self.weight(X))
+        else:
+            return self._rowsum(self.weight(X, Y))
+
+    @staticmethod
+    def _same(A, B):
+        if sparse.issparse(A) and sparse.issparse(B):
+            return A.shape == B.shape and (A != B).nnz == 0
+        elif sparse.issparse(A) or sparse.issparse(B):
+            return False
         else:
-            W_uu = self.weight(X[~labeled]) + self.smoothing
-            W_ul = self.weight(X[~labeled], X[labeled]) + self.smoothing
-        D = W_uu.sum(axis=1) + W_ul.sum(axis=1)
+            return np.array_equal(A, B)
+
+    def _laplacian_solver(self, D, W_uu):
+        '''Factorizes the graph Laplacian among the unlabeled samples. The
+        factorization is cached together with the operands it was computed
+        from, so that it can be reused by subsequent calls on the same graph,
+        e.g. a prediction following the last step of hyperparameter
+        optimization. Checking for a hit is O(n^2) against the O(n^3)
+        factorization.'''
+        for D_c, W_c, s_c, L_inv in self._factor_cache:
+            if (s_c == self.smoothing and self._same(D_c, D)
+                    and self._same(W_c, W_uu)):
+                return L_inv
 
         try:
-            L_inv = CholSolver(np.diag(D) - W_uu)
-        except np.linalg.LinAlgError:
-            L_inv = np.linalg.pinv(np.diag(D) - W_uu)
+            if sparse.issparse(W_uu):
+                L_inv = _SparseLaplacianSolver(D, W_uu, self.smoothing)
+            else:
+                L = np.subtract(-self.smoothing, W_uu, dtype=float)
+                L.flat[::len(L) + 1] += D
+                L_inv = CholSolver(L)
+        except (np.linalg.LinAlgError, RuntimeError):
+            # splu signals a singular matrix with a RuntimeError
+            L = np.subtract(
+                -self.smoothing,
+                W_uu.toarray() if sparse.issparse(W_uu) else W_uu,
+                dtype=float
+            )
+            L.flat[::len(L) + 1] += D
+            L_inv = np.linalg.pinv(L)
             warnings.warn(
                 'The Graph Laplacian is not positive definite. Some'
                 'weights on edges may be invalid.'
             )
 
+        self._factor_cache = self._factor_cache[-1:] + [
+            (D.copy(), W_uu.copy(), self.smoothing, L_inv)
+        ]
+        return L_inv
+
+    def _predict(self, X, f_l, labeled, return_influence=False):
+        n = len(labeled)
+        if len(f_l) == n:
+            raise RuntimeError(
+                'All samples are labeled, no predictions will be made.'
+            )
+        # the smoothing is a constant, i.e. rank-1, shift of the weights and is
+        # applied implicitly. The weights may be sparse, in which case they
+        # are never densified.
+        unlabeled = ~labeled
+        if self.weight == 'precomputed':
+            W_uu, D_uu = self._rowsum(X[unlabeled, :][:, unlabeled])
+            W_ul, D_ul = self._rowsum(X[unlabeled, :][:, labeled])
+        else:
+            W_uu, D_uu = self._assemble(X[unlabeled])
+            W_ul, D_ul = self._assemble(X[unlabeled], X[labeled])
+        D = D_uu + D_ul + self.smoothing * n
+        L_inv = self._laplacian_solver(D, W_uu)
+
         if return_influence is True:
-            influence = L_inv @ W_ul
+            if sparse.issparse(W_ul):
+                # solve in column blocks to cap the peak memory
+                W_ul = W_ul.tocsc()
+                influence = np.empty(W_ul.shape)
+                for j in range(0, W_ul.shape[1], 1024):
+                    influence[:, j:j + 1024] = L_inv @ (
+                        W_ul[:, j:j + 1024].toarray() + self.smoothing
+                    )
+            else:
+                influence = L_inv @ (W_ul + self.smoothing)
             f_u = influence @ f_l
             return f_u, influence
         else:
-            f_u = L_inv @ (W_ul @ f_l)
+            f_u = L_inv @ (W_ul @ f_l + self.smoothing * f_l.sum())
             return f_u
 
-    def _predict_gradient(self, X, y):
+    def _predict_gradient(self, X, f_l, labeled):
         t_metric = time.perf_counter()
-        labeled = np.isfinite(y)
-        f_l = y[labeled]
-        if len(f_l) == len(y):
+        n = len(labeled)
+        if len(f_l) == n:
             raise RuntimeError(
                 'All samples are labeled, no predictions will be made.'
             )
-        W_uu, dW_uu = self.weight(X[~labeled], eval_gradient=True)
-        W_ul, dW_ul = self.weight(X[~labeled], X[labeled], eval_gradient=True)
-        W_uu += self.smoothing
-        W_ul += self.smoothing
-        D = W_uu.sum(axis=1) + W_ul.sum(axis=1)
+        unlabeled = ~labeled
+        W_uu, dW_uu = self.weight(X[unlabeled], eval_gradient=True)
+        W_ul, dW_ul = self.weight(X[unlabeled], X[labeled], eval_gradient=True)
+        # degrees are reduced exactly as in _predict so that a subsequent
+        # prediction hits the factor cache.
+        W_uu, D_uu = self._rowsum(W_uu)
+        W_ul, D_ul = self._rowsum(W_ul)
+        D = D_uu + D_ul + self.smoothing * n
         t_metric = time.perf_counter() - t_metric
 
         t_solve = time.perf_counter()
-        try:
-            L_inv = CholSolver(np.diag(D) - W_uu).todense()
-        except np.linalg.LinAlgError:
-            L_inv = np.linalg.pinv(np.diag(D) - W_uu)
-            warnings.warn(
-                'The Graph Laplacian is not positive definite. Some'
-                'weights on edges may be invalid.'
-            )
+        L_inv = self._laplacian_solver(D, W_uu)
         t_solve = time.perf_counter() - t_solve
 
         t_chain = time.perf_counter()
-        f_u = L_inv @ (W_ul @ f_l)
-        dL_inv = L_inv * f_u
-        df_u = (
-            np.einsum('im,n,mnj->ij', L_inv, f_u, dW_uu, optimize=True)
-            + np.einsum('im,n,mnj->ij', L_inv, f_l, dW_ul, optimize=True)
-            - np.einsum('imn,mnj->ij', dL_inv[:, :, None], dW_uu)
-            - np.einsum('imn,mnj->ij', dL_inv[:, :, None], dW_ul)
+        f_u = L_inv @ (W_ul @ f_l + self.smoothing * f_l.sum())
+        # all hyperparameters share the same Laplacian, so the derivatives
+        # are obtained from a single multi-RHS solve.
+        dD = dW_uu.sum(axis=1) + dW_ul.sum(axis=1)
+        df_u = L_inv @ (
+            np.einsum('mnj,n->mj', dW_uu, f_u)
+            + np.einsum('mnj,n->mj', dW_ul, f_l)
+            - dD * f_u[:, None]
         )
         t_chain = time.perf_counter() - t_chain
 
         return f_u, df_u, t_metric, t_solve, t_chain
 
     def average_label_entropy(self, X, y, theta=None, eval_gradient=False,
-                              verbose=False):
+                              verbose=False, labeled=None, y_labeled=None):
         '''Evaluate the average label entropy of the Gaussian field model on a
         dataset.
 
@@ -307,6 +397,12 @@ class GaussianFieldRegressor:
             entropy with respect to weight hyperparameters.
         verbose: bool
             If true, print out some additional information as a markdown table.
+        labeled: 1D boolean array
+            Precomputed mask of the finite entries of y, e.g. when the
+            function is evaluated repeatedly during hyperparameter
+            optimization. Computed from y if not given.
+        y_labeled: 1D array
+            Precomputed ``y[labeled]``. Computed from y if not given.
 
         Returns
         -------
@@ -319,12 +415,16 @@ class GaussianFieldRegressor:
         if theta is not None:
             self.weight.theta = theta
 
+        if labeled is None:
+            labeled = np.isfinite(y)
+        if y_labeled is None:
+            y_labeled = y[labeled]
         if eval_gradient is True:
             z, dz, t_metric, t_solve, t_chain = self._predict_gradient(
-                X, y
+                X, y_labeled, labeled
             )
         else:
-            z = self._predict(X, y)
+            z = self._predict(X, y_labeled, labeled)
         eps = 1e-7
         z = np.minimum(1 - eps, np.maximum(eps, z))
         loss = -np.mean(z * np.log(z) + (1 - z) * np.log(1 - z))
@@ -347,7 +447,7 @@ class GaussianFieldRegressor:
         return retval
 
     def loocv_error(self, X, y, p=2, theta=None, eval_gradient=False,
-                    verbose=False):
+                    verbose=False, labeled=None, y_labeled=None):
         '''Evaluate the leave-one-out cross validation error and gradient.
 
         Parameters
@@ -366,6 +466,12 @@ class GaussianFieldRegressor:
             entropy with respect to weight hyperparameters.
         verbose: bool
             If true, print out some additional information as a markdown table.
+        labeled: 1D boolean array
+            Precomputed mask of the finite entries of y, e.g. when the
+            function is evaluated repeatedly during hyperparameter
+            optimization. Computed from y if not given.
+        y_labeled: 1D array
+            Precomputed ``y[labeled]``. Computed from y if not given.
 
         Returns
         -------
@@ -377,24 +483,25 @@ class GaussianFieldRegressor:
         if theta is not None:
             self.weight.theta = theta
 
-        labeled = np.isfinite(y)
-        y = y[labeled]
+        if labeled is None:
+            labeled = np.isfinite(y)
+        y = y[labeled] if y_labeled is None else y_labeled
         n = len(y)
         t_metric = time.perf_counter()
         if eval_gradient is True:
             W, dW = self.weight(X[labeled], eval_gradient=True)
+            D = W.sum(axis=1)
         else:
             if self.weight == 'precomputed':
-                W = X[labeled, :][:, labeled]
+                W, D = self._rowsum(X[labeled, :][:, labeled])
             else:
-                W = self.weight(X[labeled])
+                W, D = self._assemble(X[labeled])
         t_metric = time.perf_counter() - t_metric
 
         t_chain = time.perf_counter()
-        W += self.smoothing
-        D = W.sum(axis=1)
-        P = (1 / D)[:, None] * W
-        e = y - P @ y
+        D = D + self.smoothing * n
+        Wy = W @ y + self.smoothing * y.sum()
+        e = y - Wy / D
         loocv_error_p = np.mean(np.abs(e)**p)
         loocv_error = loocv_error_p**(1/p)
         if eval_gradient is True:
@@ -404,7 +511,7 @@ class GaussianFieldRegressor:
             derr_dtheta = (
                 np.einsum(
                     'pq, pqi',
-                    (derr_de / D**2 * (W @ y))[:, None],
+                    (derr_de / D**2 * Wy)[:, None],
                     dW
                 ) - np.einsum(
                     'p, q, pqi',
@@ -48,6 +48,28 @@ class Weight(ABC):
     def bounds(self):
         '''The log-scale bounds of the hyperparameters as a 2D array.'''
 
+    def assemble(self, X, Y=None, return_rowsum=False):
+        '''Computes the weight matrix and optionally its row sums. Subclasses
+        may override this method to accumulate the row sums while evaluating
+        the weights, which saves a pass over the matrix.
+
+        Parameters
+        ----------
+        X: list
+            The first dataset to be compared.
+        Y: list or None
+            The second dataset to be compared. If None, X will be compared with
+            itself.
+        return_rowsum: bool
+            If True, returns the row sums of the weight matrix alongside the
+            matrix itself.
+        '''
+        W = self(X, Y)
+        if return_rowsum is True:
+            return W, np.asarray(W.sum(axis=1)).ravel()
+        else:
+            return W
+
     def clone_with_theta(self, theta):
         clone = copy.deepcopy(self)
         clone.theta = theta
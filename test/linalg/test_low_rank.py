@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 import pytest
+import scipy.sparse as sparse
 import graphdot.linalg.low_rank as lr
 
 
@@ -63,6 +64,38 @@ def test_LLT():
     ))
 
 
+@pytest.mark.parametrize('k', [5, 10, 20])
+def test_LLT_randomized(k):
+    N = 200
+    X = np.random.randn(N, k) @ np.random.randn(k, N)
+    A = lr.LLT(X, rank=k)
+    assert(A.S.shape == (k,))
+    assert(np.allclose(A.todense(), X @ X.T))
+    assert(np.allclose(A.S, np.linalg.svd(X, compute_uv=False)[:k]))
+    B = lr.LLT(X, rcond=1e-10, rank=2 * k)
+    assert(B.S.shape == (k,))
+    assert(np.allclose(B.todense(), X @ X.T))
+    C = lr.LLT(sparse.csr_matrix(X), rank=k)
+    assert(np.allclose(C.todense(), X @ X.T))
+    assert(np.allclose(C.S, A.S))
+    state = np.random.get_state()
+    D1 = lr.dot(X, rank=k, oversample=5, random_state=0)
+    D2 = lr.dot(X, rank=k, oversample=5, random_state=0)
+    assert(np.all(D1.U == D2.U))
+    assert(np.allclose(D1.todense(), X @ X.T))
+    assert(np.all(np.random.get_state()[1] == state[1]))
+
+
+def test_LLT_randomized_small():
+    X = np.random.randn(12, 12)
+    S = np.linalg.svd(X, compute_uv=False)
+    for Y in [X, sparse.csr_matrix(X)]:
+        A = lr.LLT(Y, rank=5)
+        assert(A.S.shape == (5,))
+        assert(A.U.shape == (12, 5))
+        assert(np.allclose(A.S, S[:5]))
+
+
 @pytest.mark.parametrize('X', [
     lr.LATR(np.random.randn(100, 10), np.random.randn(10, 100)),
     lr.LLT(np.random.randn(100, 10)),
@@ -75,6 +108,11 @@ def test_sum(X, Y):
     A = X + Y
     v = np.random.randn(100)
     assert(np.allclose(A.todense(), X.todense() + Y.todense()))
+    out = np.empty((100, 100))
+    assert(A.todense(out=out) is out)
+    assert(np.allclose(out, X.todense() + Y.todense()))
+    assert(np.allclose(A @ v, A.todense() @ v))
+    assert(np.allclose(v @ A, v @ A.todense()))
     assert(np.allclose(A.T.todense(), A.todense().T))
     assert(np.allclose(-A.todense(), -(A.todense())))
     assert(np.allclose(A.diagonal(), A.todense().diagonal()))
@@ -127,6 +165,74 @@ def test_mul(X, Y):
     assert(A.quadratic(v, v) == pytest.approx(v @ A.todense() @ v))
 
 
+@pytest.mark.parametrize('X', [
+    lr.LATR(np.random.randn(100, 10), np.random.randn(10, 100)),
+    lr.LLT(np.random.randn(100, 10)),
+    lr.LLT(np.random.randn(100, 10)) - lr.LLT(np.random.randn(100, 10)),
+])
+def test_mul_dense(X):
+    B = np.random.randn(100, 100)
+    v = np.random.randn(100)
+    for A, A_dense in [
+        (X @ B, X.todense() @ B),
+        (B @ X, B @ X.todense()),
+    ]:
+        assert(isinstance(A, lr.LATR))
+        assert(np.allclose(A.todense(), A_dense))
+        assert(np.allclose(A.diagonal(), A_dense.diagonal()))
+        assert(A.trace() == pytest.approx(np.trace(A_dense)))
+        assert(A.quadratic(v, v) == pytest.approx(v @ A_dense @ v))
+    assert(np.allclose(X @ v, X.todense() @ v))
+    assert(np.allclose(v @ X, v @ X.todense()))
+
+
+def test_mul_dispatch():
+    class Scaled(lr.LATR):
+        pass
+
+    X = lr.LATR(np.random.randn(100, 10), np.random.randn(10, 100))
+    Y = Scaled(np.random.randn(100, 10), np.random.randn(10, 100))
+    # subclasses miss the built-in fast path but resolve through dispatch
+    assert(np.allclose((X @ Y).todense(), X.todense() @ Y.todense()))
+    assert(np.allclose((Y @ X).todense(), Y.todense() @ X.todense()))
+
+    @lr.matmul.register(Scaled)
+    def _(A, B):
+        return 'scaled'
+
+    assert(Y @ X == 'scaled')
+    assert(isinstance(X @ X, lr.LATR))
+
+
+def test_sum_canonicalize():
+    lhs = np.random.randn(100, 10)
+    X = lr.LATR(lhs, np.random.randn(10, 100))
+    Y = lr.LATR(lhs, np.random.randn(10, 100))
+    Z = lr.LLT(np.random.randn(100, 10))
+    E = lr.LATR(np.zeros((100, 0)), np.zeros((0, 100)))
+    A = X + Z
+    B = A + Y - E
+    assert(len(A.factors) == 2)
+    assert(len(B.factors) == 2)
+    assert(np.allclose(A.todense(), X.todense() + Z.todense()))
+    assert(np.allclose(
+        B.todense(), X.todense() + Y.todense() + Z.todense()
+    ))
+    C = (X - Y) + (Z - Z)
+    assert(len(C.factors) == 2)
+    assert(np.allclose(C.todense(), X.todense() - Y.todense()))
+    L = lr.LLT(np.random.randn(100, 10))
+    M = L + L + L**2
+    assert(L._lhs is None)
+    assert(M.trace() == pytest.approx(np.trace(M.todense())))
+    assert(np.allclose(M.diagonal(), M.todense().diagonal()))
+    assert(L._lhs is None)
+    assert(len(M.factors) == 1)
+    assert(np.allclose(
+        M.todense(), 2 * L.todense() + L.todense() @ L.todense()
+    ))
+
+
 def test_long_sum():
     X = [lr.LLT(np.random.randn(100, 10)) for _ in range(10)]
     A = X[0]
@@ -2,11 +2,12 @@
 # -*- coding: utf-8 -*-
 import numpy as np
 import pytest
+import scipy.sparse as sparse
 from scipy.spatial import distance_matrix as pairwise_distances
 from scipy.spatial.distance import cdist
 from unittest.mock import MagicMock
 from graphdot.model.gaussian_field import GaussianFieldRegressor
-from graphdot.model.gaussian_field import Weight
+from graphdot.model.gaussian_field import Weight, RBFOverFixedDistance
 
 
 @pytest.mark.parametrize('case', [
@@ -143,6 +144,184 @@ def test_gaussian_field_influence(case):
     assert np.allclose(influence, truth)
 
 
+@pytest.mark.parametrize('smoothing', [0, 0.01, 0.1])
+def test_gaussian_field_sparse_weight(smoothing):
+    n = 50
+    W = np.diag(np.random.rand(n - 1), 1)
+    W[np.random.rand(n, n) < 0.1] = np.random.rand()
+    W = W + W.T
+    W[np.diag_indices_from(W)] = 0
+
+    class WeightLookUpTable:
+        def __init__(self, W):
+            self.W = W
+
+        def __call__(self, X, Y=None):
+            return self.W[X, :][:, X if Y is None else Y]
+
+    X = np.arange(n)
+    y = np.random.randn(n)
+    y[np.random.rand(n) < 0.7] = np.nan
+    y[0] = 0.0
+
+    dense = GaussianFieldRegressor(WeightLookUpTable(W), smoothing=smoothing)
+    csr = GaussianFieldRegressor(
+        WeightLookUpTable(sparse.csr_matrix(W)), smoothing=smoothing
+    )
+    z1, i1 = dense.predict(X, y, return_influence=True)
+    z2, i2 = csr.predict(X, y, return_influence=True)
+    assert np.allclose(z1, z2)
+    assert np.allclose(i1, i2)
+    assert np.allclose(csr.predict(X, y), z1)
+
+
+@pytest.mark.parametrize('smoothing', [0, 0.1])
+def test_gaussian_field_assembled_weight(smoothing):
+    n = 20
+    D = cdist(*[np.random.randn(n, 3)] * 2)
+    fused = RBFOverFixedDistance(D, sigma=1.0)
+
+    class Unfused:
+        def __call__(self, X, Y=None):
+            return fused(X, Y)
+
+    X = np.arange(n)
+    y = np.random.randn(n)
+    y[::3] = np.nan
+    g1 = GaussianFieldRegressor(fused, smoothing=smoothing)
+    g2 = GaussianFieldRegressor(Unfused(), smoothing=smoothing)
+    assert np.allclose(g1.predict(X, y), g2.predict(X, y))
+    assert g1.loocv_error(X, y) == pytest.approx(g2.loocv_error(X, y))
+
+
+def test_gaussian_field_singular_laplacian():
+    # node 3 is unlabeled and disconnected from the rest of the graph
+    W = np.array([
+        [0.0, 1.0, 0.0, 0.0],
+        [1.0, 0.0, 1.0, 0.0],
+        [0.0, 1.0, 0.0, 0.0],
+        [0.0, 0.0, 0.0, 0.0],
+    ])
+    X = np.arange(4)
+    y = np.array([0.0, np.nan, 1.0, np.nan])
+
+    z = []
+    for w in [W, sparse.csr_matrix(W)]:
+        g = GaussianFieldRegressor(
+            lambda X, Y=None, w=w: w[X, :][:, X if Y is None else Y],
+            smoothing=0
+        )
+        with pytest.warns(UserWarning, match='not positive definite'):
+            z.append(g.predict(X, y))
+    assert z[0][1] == pytest.approx(0.5)
+    assert np.allclose(z[0], z[1])
+
+
+def test_gaussian_field_factor_cache():
+
+    class ScaledDistance:
+        def __init__(self, s):
+            self.s = s
+
+        def __call__(self, X, Y=None):
+            return np.exp(-self.s * cdist(X, X if Y is None else Y))
+
+        @property
+        def theta(self):
+            return np.log([self.s])
+
+        @theta.setter
+        def theta(self, values):
+            self.s = np.exp(values)[0]
+
+    g = GaussianFieldRegressor(ScaledDistance(1.0), smoothing=0)
+    X = np.random.randn(10, 2)
+    y = np.random.randn(10)
+    y[::2] = np.nan
+
+    z1 = g.predict(X, y)
+    z2 = g.predict(X, y)
+    assert len(g._factor_cache) == 1
+    assert np.all(z1 == z2)
+
+    g.weight.theta = np.log([2.0])
+    z3 = g.predict(X, y)
+    assert len(g._factor_cache) == 2
+    assert not np.allclose(z1, z3)
+    assert np.allclose(
+        z3, GaussianFieldRegressor(ScaledDistance(2.0), smoothing=0).predict(
+            X, y
+        )
+    )
+
+    g.predict(X.copy(), y)
+    assert len(g._factor_cache) == 2
+
+    # the cache must follow the weights even if they change without any
+    # hyperparameters to tell
+    weight = ScaledDistance(0.5)
+    g.weight = lambda X, Y=None: weight(X, Y)
+    z4 = g.predict(X, y)
+    weight.s = 0.7
+    z5 = g.predict(X, y)
+    assert not np.allclose(z4, z5)
+    assert np.allclose(
+        z5,
+        GaussianFieldRegressor(ScaledDistance(0.7), smoothing=0).predict(X, y)
+    )
+
+
+def test_gaussian_field_factor_cache_precomputed():
+    n = 6
+    X = np.random.rand(n, n)
+    X = X + X.T
+    X[np.diag_indices_from(X)] = 0
+    y = np.random.randn(n)
+    y[:4] = np.nan
+
+    g = GaussianFieldRegressor(weight='precomputed', smoothing=0)
+    g.predict(X, y)
+    M = np.random.rand(n, n)
+    X *= M + M.T
+    assert np.allclose(
+        g.predict(X, y),
+        GaussianFieldRegressor(weight='precomputed', smoothing=0).predict(
+            X, y
+        )
+    )
+
+
+def test_gaussian_field_factor_cache_fit_predict(monkeypatch):
+    import graphdot.model.gaussian_field.gfr as gfr
+    factorizations = []
+
+    class CountingCholSolver(gfr.CholSolver):
+        def __init__(self, *args, **kwargs):
+            factorizations.append(1)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(gfr, 'CholSolver', CountingCholSolver)
+
+    X = np.random.randn(20, 2)
+    D = cdist(X, X)
+    y = (X[:, 0] > 0).astype(float)
+    y[::2] = np.nan
+    idx = np.arange(len(X))
+
+    g = GaussianFieldRegressor(
+        RBFOverFixedDistance(D, sigma=1.0), optimizer=True, smoothing=1e-3
+    )
+    g.average_label_entropy(idx, y, eval_gradient=True)
+    assert len(factorizations) == 1
+    g.predict(idx, y)
+    assert len(factorizations) == 1
+
+    g.fit(idx, y, loss='ale')
+    n = len(factorizations)
+    g.predict(idx, y)
+    assert len(factorizations) == n
+
+
 def test_average_label_entropy():
 
     g = GaussianFieldRegressor(weight='precomputed', smoothing=0)
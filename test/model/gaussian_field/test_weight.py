@@ -63,6 +63,11 @@ def test_rbf_over_fixed_distance():
         assert np.allclose(weight(X).diagonal(), 0)
         assert np.all(weight(X, Y) > 0)
         assert np.all(weight(X, Y) < 1)
+        for Z in [(X,), (X, Y)]:
+            W, rowsum = weight.assemble(*Z, return_rowsum=True)
+            assert np.allclose(W, weight(*Z))
+            assert np.allclose(rowsum, weight(*Z).sum(axis=1))
+            assert np.allclose(weight.assemble(*Z), weight(*Z))
 
 
 @pytest.mark.parametrize('sigma', [0.5, 1.0, 2.0])
@@ -113,6 +118,10 @@ def test_rbf_over_distance():
             assert np.allclose(weight(Y).diagonal(), 0)
             assert np.all(weight(X, Y) > 0)
             assert np.all(weight(X, Y) < 1)
+            for Z in [(X,), (X, Y)]:
+                W, rowsum = weight.assemble(*Z, return_rowsum=True)
+                assert np.allclose(W, weight(*Z))
+                assert np.allclose(rowsum, weight(*Z).sum(axis=1))
 
 
 @pytest.mark.parametrize('xi', [1.0, 2.0, 3.0])